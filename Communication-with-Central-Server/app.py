@@ -1,6 +1,10 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify
+import json
 import os
+import shutil
+import tempfile
 from datetime import datetime
+from waitress import serve
 
 app = Flask(__name__)
 
@@ -9,6 +13,48 @@ UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploaded_pcaps')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # Reject uploads above 1 GB
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+DUMMY_MESSAGE_TEMPLATE = ("Hello from Central Server! You are currently out of RSU zone.\n"
+                          "Your ID: {laptop_id}\n"
+                          "Timestamp: {timestamp}")
+
+# Every uploaded file is spooled to a named temp file inside UPLOAD_FOLDER so it can be renamed into place
+class DiskSpooledRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spooled_paths = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = tempfile.NamedTemporaryFile('wb+', dir=UPLOAD_FOLDER, suffix='.part', delete=False)
+        self.spooled_paths.append(stream.name)
+        return stream
+
+    def close(self):
+        super().close()
+        # Spooled files that were not moved into place (rejected or failed uploads)
+        for path in self.spooled_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+app.request_class = DiskSpooledRequest
+
+def store_upload(file, save_path):
+    src = getattr(file.stream, 'name', None)
+    if not isinstance(src, str) or not os.path.exists(src):
+        # Upload is not backed by a named file on disk, copy it out in 1 MB chunks
+        with open(save_path, 'wb') as out:
+            shutil.copyfileobj(file.stream, out, length=COPY_CHUNK_SIZE)
+        return
+
+    file.stream.close()  # Windows cannot rename a file that is still open
+    if os.stat(src).st_dev == os.stat(os.path.dirname(save_path)).st_dev:
+        # Same filesystem: the spooled temp file simply becomes the upload, no data is copied
+        os.replace(src, save_path)
+    else:
+        shutil.copyfile(src, save_path)  # uses sendfile()/copy_file_range() where the OS has them
 
 @app.route('/')
 def home():
@@ -19,19 +65,22 @@ def upload_pcap():
     if 'pcap_file' not in request.files:
         return jsonify({"message": "No file part in request"}), 400
 
-    file = request.files['pcap_file']
+    # Uploaders may batch several snapshots into one request under the same field name
+    files = request.files.getlist('pcap_file')
     
-    if file.filename == '':
+    if any(file.filename == '' for file in files):
         return jsonify({"message": "No file selected"}), 400
 
     laptop_id = request.form.get('laptop_id', 'Unknown_Laptop')
     laptop_folder = os.path.join(app.config['UPLOAD_FOLDER'], laptop_id)
     os.makedirs(laptop_folder, exist_ok=True)
 
-    save_path = os.path.join(laptop_folder, file.filename)
-    file.save(save_path)
+    for file in files:
+        save_path = os.path.join(laptop_folder, file.filename)
+        store_upload(file, save_path)
 
-    return jsonify({"message": f"File '{file.filename}' uploaded successfully"}), 200
+    names = ", ".join(f"'{file.filename}'" for file in files)
+    return jsonify({"message": f"File(s) {names} uploaded successfully"}), 200
 
 @app.route('/get_dummy_message', methods=['GET'])
 def get_dummy_message():
@@ -42,11 +91,11 @@ def get_dummy_message():
 
     # Dynamically generate dummy message at poll time
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    msg = (f"Hello from Central Server! You are currently out of RSU zone.\n"
-           f"Your ID: {laptop_id}\n"
-           f"Timestamp: {timestamp}")
+    msg = DUMMY_MESSAGE_TEMPLATE.format(laptop_id=laptop_id, timestamp=timestamp)
 
-    return {"message": msg}, 200
+    # Polled every few seconds: encode just the string instead of a dict through Flask's JSON provider
+    return Response('{"message": ' + json.dumps(msg) + '}', status=200, mimetype='application/json')
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Multi-threaded WSGI server so uploads from several laptops are handled concurrently
+    serve(app, host='0.0.0.0', port=5000, threads=8)
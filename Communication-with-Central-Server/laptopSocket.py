@@ -2,7 +2,6 @@ import socket
 import time
 import requests
 from datetime import datetime
-from pathlib import Path
 
 # Target OBU Details
 UDP_IP = "192.168.52.79"
@@ -11,41 +10,75 @@ UDP_PORT = 12345
 # Central Server Details
 CENTRAL_SERVER_URL = "http://127.0.0.1:5000/get_dummy_message"
 LAPTOP_ID = "Laptop001"
+POLL_TIMEOUT = 5
+POLL_INTERVAL = 10
+
+# Local signals from monitor_detection (one byte per datagram)
+SIGNAL_ADDR = ("127.0.0.1", 7000)
+SIG_RX_STALLED = b"S"
+SIG_RX_RESUMED = b"R"
+SIG_OBU_HALTED = b"H"
+
+# Keep-alive session: every poll reuses the same TCP connection to the central server
+SESSION = requests.Session()
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, 0x10)  # IPTOS_LOWDELAY
+
+sig_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sig_sock.bind(SIGNAL_ADDR)
+# Short timeout keeps Ctrl+C responsive on Windows, where a blocking recvfrom() can't be interrupted
+sig_sock.settimeout(1)
+
+
+def relay_server_message():
+    try:
+        response = SESSION.get(CENTRAL_SERVER_URL, params={"laptop_id": LAPTOP_ID}, timeout=POLL_TIMEOUT)
+        if response.status_code == 200:
+            msg = response.json().get("message")
+            if msg:
+                sock.sendto(msg.encode(), (UDP_IP, UDP_PORT))
+                print(f"\nReceived message from the central server and it has been sent to OBU.\n The actual message from the central server is:\n{msg}")
+            else:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] No message from server.")
+        else:
+            print(f"[ERROR] Server response error: {response.text}")
+
+    except Exception as e:
+        print(f"[ERROR] {e}")
+
 
 print("[INFO] Monitoring RX stall status and polling Central Server for dummy messages...")
 
+rx_stalled = False
+next_poll = 0.0
+
 try:
     while True:
-        if Path("obu_halted.flag").exists():
+        try:
+            signal, _ = sig_sock.recvfrom(8)
+        except socket.timeout:
+            signal = None
+
+        if signal == SIG_OBU_HALTED:
             print("[INFO] OBU halt detected based on TX file. Stopping polling...\n")
             break
 
-        if Path("rx_stalled.flag").exists():
-            try:
-                response = requests.get(CENTRAL_SERVER_URL, params={"laptop_id": LAPTOP_ID})
-                if response.status_code == 200:
-                    msg = response.json().get("message")
-                    if msg:
-                        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        sock.sendto(msg.encode(), (UDP_IP, UDP_PORT))
-                        print(f"\nReceived message from the central server and it has been sent to OBU.\n The actual message from the central server is:\n{msg}")
-                    else:
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] No message from server.")
-                else:
-                    print(f"[ERROR] Server response error: {response.text}")
-
-            except Exception as e:
-                print(f"[ERROR] {e}")
-
-        else:
+        if signal == SIG_RX_STALLED and not rx_stalled:
+            rx_stalled = True
+            next_poll = 0.0  # poll straight away on a fresh stall
+        elif signal == SIG_RX_RESUMED and rx_stalled:
+            rx_stalled = False
             print(f"[{datetime.now().strftime('%H:%M:%S')}] RX growing → No packet sent.")
 
-        time.sleep(10)
+        if rx_stalled and time.monotonic() >= next_poll:
+            relay_server_message()
+            next_poll = time.monotonic() + POLL_INTERVAL
 
 except KeyboardInterrupt:
     print("\n[INFO] Script stopped by user.")
 
 finally:
+    SESSION.close()
+    sig_sock.close()
     sock.close()
@@ -1,14 +1,32 @@
 from __future__ import annotations
+import hashlib
+import mmap
+import socket
+import struct
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import paramiko
-from scapy.all import rdpcap, wrpcap
+from paramiko.sftp import CMD_ATTRS, CMD_STAT
 
 # OBU Connection Details
 OBU_IP = "192.168.52.79"
 OBU_USER = "user"
 OBU_PASS = "user"
+OBU_SSH_PORT = 22
+SOCK_BUF_SIZE = 32 << 20
+SFTP_WINDOW_SIZE = 1 << 27
+SFTP_MAX_PACKET_SIZE = 32768
+MAX_PREFETCH_REQUESTS = 128
+PULL_CHUNK_SIZE = 1 << 20
+PREFIX_CHECK_SIZE = 4096
+
+# pcap layout: 24-byte global header, then a 16-byte header before every record
+PCAP_GLOBAL_HDR_LEN = 24
+PCAP_RECORD_HDR_LEN = 16
+PCAP_MAGICS = (0xA1B2C3D4, 0xA1B23C4D)  # microsecond / nanosecond timestamps
 
 # Remote Paths on OBU
 RX_PCAP_PATH = "/mnt/rw/log/current/rx_pc5.pcap"
@@ -24,39 +42,159 @@ TX_STALL_THRESHOLD = 4
 # Local Paths
 LOCAL_OUTPUT = Path("selective_tx_snapshots_v451")
 LOCAL_TX_FULL = LOCAL_OUTPUT / "tx_pc5_full.pcap"
-OBU_HALT_FLAG = Path("obu_halted.flag")
 
-# Cleanup old halt flag if present
-OBU_HALT_FLAG.unlink(missing_ok=True)
+# Local signals to laptopSocket (one byte per datagram)
+SIGNAL_ADDR = ("127.0.0.1", 7000)
+SIG_RX_STALLED = b"S"
+SIG_RX_RESUMED = b"R"
+SIG_OBU_HALTED = b"H"
+
+
+def _pcap_endian(header: bytes) -> str:
+    if struct.unpack("<I", header[:4])[0] in PCAP_MAGICS:
+        return "<"
+    if struct.unpack(">I", header[:4])[0] in PCAP_MAGICS:
+        return ">"
+    raise ValueError("not a classic pcap file")
+
+
+class _StatReplies:
+    # Receives replies to pipelined FXP_STAT requests; paramiko hands them over via _async_response
+    def __init__(self):
+        self.replies = {}
+
+    def _async_response(self, t, msg, num):
+        self.replies[num] = (t, msg)
 
 
 class SnapshotManager:
     def __init__(self):
-        self.cached_packets = []
+        # Byte offset of every complete record in LOCAL_TX_FULL; packets are never dissected
+        self.offsets = []
+        self.header_bytes = b""
+        self._endian = "<"
+        self._parse_pos = 0
+        self._last_size = 0
+        self._prefix_hash = b""
+        self._mm = None
 
     def pull_tx_file(self, sftp: paramiko.SFTPClient) -> bool:
         LOCAL_OUTPUT.mkdir(exist_ok=True)
+        self._unmap()  # a mapped file cannot be truncated/extended on Windows
         try:
-            sftp.get(TX_PCAP_PATH, str(LOCAL_TX_FULL))
-            self.cached_packets = rdpcap(str(LOCAL_TX_FULL))
-            print(f"Pulled full TX ({len(self.cached_packets)} packets) → {LOCAL_TX_FULL.name}")
+            new_size = sftp.stat(TX_PCAP_PATH).st_size
+            with sftp.open(TX_PCAP_PATH, "rb") as rf:
+                # Appending is only safe if the OBU extended the same file rather than rotating it
+                if new_size < self._last_size or self._prefix_changed(rf):
+                    print("TX file was replaced on OBU, pulling it again from the start")
+                    self._reset()
+                pulled = new_size - self._last_size
+                if pulled > 0:
+                    self._append_remote(rf, new_size)
+            self._index_new_packets()
+            self._map()
+            print(f"Pulled TX (+{pulled:,} bytes, {len(self.offsets)} packets) → {LOCAL_TX_FULL.name}")
             return True
         except Exception as e:
             print(f"TX pull failed: {e}")
             return False
 
+    def _reset(self):
+        self.offsets = []
+        self.header_bytes = b""
+        self._parse_pos = 0
+        self._last_size = 0
+        self._prefix_hash = b""
+
+    def _prefix_changed(self, rf: paramiko.SFTPFile) -> bool:
+        if not self._prefix_hash:
+            return False
+        return hashlib.md5(rf.read(PREFIX_CHECK_SIZE)).digest() != self._prefix_hash
+
+    def _map(self):
+        if self._last_size > 0:
+            with open(LOCAL_TX_FULL, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _unmap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _append_remote(self, rf: paramiko.SFTPFile, new_size: int):
+        # Only the bytes appended since the previous pull cross the link. prefetch() gets the size
+        # from our own stat, so the reads are pipelined without it stat-ing the open file again.
+        rf.seek(self._last_size)
+        rf.prefetch(new_size, max_concurrent_requests=MAX_PREFETCH_REQUESTS)
+        remaining = new_size - self._last_size
+        with open(LOCAL_TX_FULL, "ab") as lf:
+            lf.truncate(self._last_size)  # drop leftovers of an interrupted pull
+            while remaining > 0:
+                data = rf.read(min(PULL_CHUNK_SIZE, remaining))
+                if not data:
+                    raise IOError("TX file shrank during pull")
+                lf.write(data)
+                remaining -= len(data)
+        self._last_size = new_size
+        if new_size >= PREFIX_CHECK_SIZE and not self._prefix_hash:
+            with open(LOCAL_TX_FULL, "rb") as lf:
+                self._prefix_hash = hashlib.md5(lf.read(PREFIX_CHECK_SIZE)).digest()
+
+    def _index_new_packets(self):
+        if self._last_size < PCAP_GLOBAL_HDR_LEN:  # pcap global header not written yet
+            return
+        with open(LOCAL_TX_FULL, "rb") as f:
+            if not self.header_bytes:
+                self.header_bytes = f.read(PCAP_GLOBAL_HDR_LEN)
+                self._endian = _pcap_endian(self.header_bytes)
+                self._parse_pos = PCAP_GLOBAL_HDR_LEN
+            f.seek(self._parse_pos)
+            while True:
+                hdr = f.read(PCAP_RECORD_HDR_LEN)
+                if len(hdr) < PCAP_RECORD_HDR_LEN:
+                    break
+                incl_len = struct.unpack(self._endian + "IIII", hdr)[2]
+                rec_end = self._parse_pos + PCAP_RECORD_HDR_LEN + incl_len
+                if rec_end > self._last_size:
+                    break  # record still being written on the OBU, pick it up on the next pull
+                self.offsets.append(self._parse_pos)
+                self._parse_pos = rec_end
+                f.seek(incl_len, 1)
+
     def extract_snapshot(self, pkt_start: int, pkt_end: int, label: str):
         ts = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
         out_file = LOCAL_OUTPUT / f"tx_clean_{label}_{ts}.pcap"
         try:
-            sliced = self.cached_packets[pkt_start:pkt_end]
-            wrpcap(str(out_file), sliced)
-            print(f"Snapshot saved: {out_file.name} ({len(sliced)} packets)")
+            # Records are contiguous, so the slice is one byte range of the mapped file;
+            # copying it verbatim keeps the original timestamps
+            n_pkts = len(self.offsets[pkt_start:pkt_end])
+            # Written under a temporary name and renamed once complete, so the uploader never sees a partial pcap
+            part_file = out_file.with_name(out_file.name + ".part")
+            with open(part_file, "wb") as dst:
+                dst.write(self.header_bytes)
+                if n_pkts:
+                    byte_start = self.offsets[pkt_start]
+                    byte_end = self.offsets[pkt_end] if pkt_end < len(self.offsets) else self._parse_pos
+                    # Slicing the mmap itself would copy the whole range into a bytes object first;
+                    # a memoryview hands the mapped pages straight to write()
+                    with memoryview(self._mm)[byte_start:byte_end] as records:
+                        dst.write(records)
+            part_file.replace(out_file)
+            if n_pkts:
+                first = self._record_time(self.offsets[pkt_start])
+                last = self._record_time(self.offsets[pkt_start + n_pkts - 1])
+                print(f"Snapshot saved: {out_file.name} ({n_pkts} packets, {first:%H:%M:%S} → {last:%H:%M:%S})")
+            else:
+                print(f"Snapshot saved: {out_file.name} (0 packets)")
         except Exception as e:
             print(f"Snapshot write failed: {e}")
 
+    def _record_time(self, offset: int) -> datetime:
+        # ts_sec is the first field of the record header; no need to dissect the packet
+        return datetime.fromtimestamp(struct.unpack_from(self._endian + "I", self._mm, offset)[0])
+
     def count_packets(self) -> int:
-        return len(self.cached_packets)
+        return len(self.offsets)
 
 
 class Copier:
@@ -71,32 +209,117 @@ class Copier:
         self.final_snapshot_taken = False
         self.snapshot_mgr = SnapshotManager()
         self.rsu_detected = False
+        self._transport = None
+        self.sftp = None
+        # TX pulls and snapshot writes run on one worker (in submission order) so polling never waits on them
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()  # guards snapshot_start_idx, stall_open, final_snapshot_taken, rx_signal
+        self.stall_open = False
+        self.xfer_sftp = None
+        self.sig_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rx_signal = SIG_RX_RESUMED  # last RX state sent, repeated every poll for listeners that start late
+
+    def _connect(self):
+        print("Connecting to OBU…")
+        sock = socket.create_connection((OBU_IP, OBU_SSH_PORT), timeout=10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF_SIZE)
+        # A larger channel window keeps more SFTP reads in flight per round trip
+        self._transport = paramiko.Transport(sock, default_window_size=SFTP_WINDOW_SIZE,
+                                             default_max_packet_size=SFTP_MAX_PACKET_SIZE)
+        self._transport.connect(username=OBU_USER, password=OBU_PASS)
+        self.sftp = paramiko.SFTPClient.from_transport(self._transport, window_size=SFTP_WINDOW_SIZE,
+                                                       max_packet_size=SFTP_MAX_PACKET_SIZE)
+        # Separate SFTP channel on the same transport, so size probes are not queued behind a TX pull
+        self.xfer_sftp = paramiko.SFTPClient.from_transport(self._transport, window_size=SFTP_WINDOW_SIZE,
+                                                            max_packet_size=SFTP_MAX_PACKET_SIZE)
+        print(f"Connected to {OBU_IP}")
+
+    def _ensure_connected(self):
+        # Transport is reused across polls; only rebuilt after run() has dropped it
+        if self._transport is None or not self._transport.is_active():
+            self._disconnect()
+            self._connect()
+
+    def _disconnect(self):
+        try: self.xfer_sftp.close()
+        except: pass
+        try: self.sftp.close()
+        except: pass
+        try: self._transport.close()
+        except: pass
+        self.xfer_sftp = None
+        self.sftp = None
+        self._transport = None
 
-    def _get_size(self, ssh: paramiko.SSHClient, path: str) -> int:
-        for cmd in (f"stat -c %s {path}", f"wc -c < {path}"):
+    def _signal(self, code: bytes | None = None):
+        # Without a code, repeats the last RX state; locked so a repeat can't overtake a newer state
+        with self._lock:
+            if code is None:
+                code = self.rx_signal
+            elif code != SIG_OBU_HALTED:
+                self.rx_signal = code
             try:
-                _, out, _ = ssh.exec_command(cmd)
-                val = out.read().decode().strip()
-                if val.isdigit():
-                    return int(val)
-            except:
-                pass
-        return -1
+                self.sig_sock.sendto(code, SIGNAL_ADDR)
+            except OSError:
+                pass  # nobody listening is fine
+
+    def _submit(self, fn, *args):
+        self.pool.submit(fn, *args).add_done_callback(self._report_failure)
+
+    @staticmethod
+    def _report_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Snapshot task failed: {future.exception()}")
+
+    def _start_snapshot(self):
+        with self._lock:
+            pkt_start = self.snapshot_start_idx  # set if the previous snapshot was never saved; keep its start
+        if pkt_start is None:
+            if not self.snapshot_mgr.pull_tx_file(self.xfer_sftp):
+                with self._lock:
+                    self.stall_open = False  # retried on the next poll
+                return
+            pkt_start = self.snapshot_mgr.count_packets()
+            with self._lock:
+                self.snapshot_start_idx = pkt_start
+        print(f"RX stalled. TX pkt start = {pkt_start}")
+        self._signal(SIG_RX_STALLED)
+
+    def _finish_snapshot(self, label: str):
+        with self._lock:
+            pkt_start = self.snapshot_start_idx
+        if pkt_start is not None and self.snapshot_mgr.pull_tx_file(self.xfer_sftp):
+            pkt_end = self.snapshot_mgr.count_packets()
+            self.snapshot_mgr.extract_snapshot(pkt_start, pkt_end, label)
+            with self._lock:
+                self.snapshot_start_idx = None
+                self.final_snapshot_taken = False
+
+    def _get_sizes(self) -> tuple[int, int]:
+        # Both FXP_STAT requests go out before either reply is awaited: one round trip instead of two.
+        # A failed stat (missing file) reports -1; transport errors propagate so run() reconnects.
+        replies = _StatReplies()
+        nums = [self.sftp._async_request(replies, CMD_STAT, path) for path in (RX_PCAP_PATH, TX_PCAP_PATH)]
+        while len(replies.replies) < len(nums):
+            self.sftp._read_response()
+        sizes = []
+        for num in nums:
+            t, msg = replies.replies[num]
+            sizes.append(paramiko.SFTPAttributes._from_msg(msg).st_size if t == CMD_ATTRS else -1)
+        return sizes[0], sizes[1]
 
     def run(self):
         try:
             while True:
                 try:
-                    print("Connecting to OBU…")
-                    ssh = paramiko.SSHClient()
-                    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                    ssh.connect(OBU_IP, username=OBU_USER, password=OBU_PASS, timeout=10)
-                    sftp = ssh.open_sftp()
-                    print(f"Connected to {OBU_IP}")
+                    self._ensure_connected()
 
                     while True:
-                        rx_sz = self._get_size(ssh, RX_PCAP_PATH)
-                        tx_sz = self._get_size(ssh, TX_PCAP_PATH)
+                        # Polls run on a fixed cadence: probe time counts towards CHECK_INTERVAL
+                        next_poll = time.monotonic() + CHECK_INTERVAL
+                        rx_sz, tx_sz = self._get_sizes()
 
                         # RX Zone Detection
                         if rx_sz > 0 and rx_sz > self.prev_rx_size:
@@ -110,26 +333,24 @@ class Copier:
                             self.rx_stalled_cnt += 1
                         else:
                             if self.rx_stalled and self.rx_growth_cnt >= RX_RESUME_THRESHOLD:
-                                if self.snapshot_start_idx is not None:
+                                with self._lock:
+                                    stall_open, self.stall_open = self.stall_open, False
+                                if stall_open:
                                     print("RX resumed. Saving normal TX snapshot…")
-                                    if self.snapshot_mgr.pull_tx_file(sftp):
-                                        pkt_end = self.snapshot_mgr.count_packets()
-                                        self.snapshot_mgr.extract_snapshot(self.snapshot_start_idx, pkt_end, "normal")
-                                        self.snapshot_start_idx = None
-                                        self.final_snapshot_taken = False
-                                    Path("rx_stalled.flag").unlink(missing_ok=True)
+                                    self._submit(self._finish_snapshot, "normal")
+                                    # Queued behind the snapshot tasks so a pending stall task cannot override it
+                                    self._submit(self._signal, SIG_RX_RESUMED)
                                 self.rx_stalled_cnt = 0
                                 self.tx_steady_cnt = 0
 
                         self.rx_stalled = self.rx_stalled_cnt >= STALL_THRESHOLD
 
                         # Snapshot during Stall
-                        if self.rx_stalled and self.snapshot_start_idx is None:
-                            if self.snapshot_mgr.pull_tx_file(sftp):
-                                pkt_count = self.snapshot_mgr.count_packets()
-                                self.snapshot_start_idx = pkt_count
-                                print(f"RX stalled. TX pkt start = {pkt_count}")
-                                Path("rx_stalled.flag").write_text("1")
+                        if self.rx_stalled:
+                            with self._lock:
+                                stall_open, self.stall_open = self.stall_open, True
+                            if not stall_open:
+                                self._submit(self._start_snapshot)
 
                         # TX Steady Detection for OBU halt (independent of RX stall)
                         if tx_sz == self.prev_tx_size:
@@ -139,33 +360,34 @@ class Copier:
 
                         if self.tx_steady_cnt >= TX_STALL_THRESHOLD:
                             print("OBU has halted based on TX file. Saving final snapshot and stopping monitoring…")
-                            if self.snapshot_start_idx is not None:
-                                if self.snapshot_mgr.pull_tx_file(sftp):
-                                    pkt_end = self.snapshot_mgr.count_packets()
-                                    self.snapshot_mgr.extract_snapshot(self.snapshot_start_idx, pkt_end, "final")
+                            # Skipped inside the task when no stall start was recorded
+                            self._submit(self._finish_snapshot, "final")
+                            self.pool.shutdown(wait=True)
 
-                            OBU_HALT_FLAG.write_text("1")
+                            self._signal(SIG_OBU_HALTED)
                             return  # Exit monitoring
 
                         self.prev_rx_size = rx_sz
                         self.prev_tx_size = tx_sz
 
+                        self._signal()
+
                         status = "STALLED" if self.rx_stalled else ("growing" if self.rsu_detected else "no RSU zone yet")
                         print(f"rx size = {rx_sz:,} | {status}")
 
-                        time.sleep(CHECK_INTERVAL)
+                        time.sleep(max(0.0, next_poll - time.monotonic()))
 
                 except Exception as e:
                     print(f"SSH error: {e} – reconnecting in 10s…")
+                    self._disconnect()
                     time.sleep(10)
-                finally:
-                    try: sftp.close()
-                    except: pass
-                    try: ssh.close()
-                    except: pass
 
         except KeyboardInterrupt:
             print("User manually stopped the OBU monitoring code.")
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self._disconnect()
+            self.sig_sock.close()
 
 
 if __name__ == "__main__":
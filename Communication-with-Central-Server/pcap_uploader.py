@@ -1,38 +1,120 @@
-import os
+import queue
+import threading
 import time
 import requests
+from contextlib import ExitStack
 from pathlib import Path
+from requests_toolbelt import MultipartEncoder
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+from watchdog.events import PatternMatchingEventHandler
 
 WATCH_FOLDER = Path(r"C:\Users\Admin\OneDrive\Desktop\selective_tx_snapshots_v451")
+UPLOADED_FOLDER = WATCH_FOLDER / "uploaded"
 CENTRAL_SERVER_URL = "http://127.0.0.1:5000/upload_pcap"
 LAPTOP_ID = "Laptop001"
+SNAPSHOT_PATTERN = "tx_clean_*.pcap"
+RETRY_DELAY = 5
+UPLOAD_TIMEOUT = 30
+POLL_FALLBACK_INTERVAL = 5
+MAX_BATCH_FILES = 16
 
-uploaded_files = set()
+# One pooled keep-alive connection to the central server instead of a new one per upload
+SESSION = requests.Session()
+pending = queue.Queue()
 
-print(f"Monitoring {WATCH_FOLDER} folder for completed TX snapshots to upload to the central server…")
 
-try:
+class SnapshotHandler(PatternMatchingEventHandler):
+    def __init__(self):
+        super().__init__(patterns=[SNAPSHOT_PATTERN], ignore_directories=True)
+
+    def on_created(self, event):
+        pending.put(Path(event.src_path))
+
+    def on_moved(self, event):
+        # The monitor writes snapshots as *.part and renames them once complete
+        dest = Path(event.dest_path)
+        if dest.parent == WATCH_FOLDER:
+            pending.put(dest)
+
+
+def next_batch():
+    # Blocks for the first snapshot, then takes whatever else is already queued (up to MAX_BATCH_FILES)
+    batch = [pending.get()]
+    while len(batch) < MAX_BATCH_FILES:
+        try:
+            batch.append(pending.get_nowait())
+        except queue.Empty:
+            break
+    # Drop duplicates (startup scan + event) and files already uploaded and moved away
+    return [file for file in dict.fromkeys(batch) if file.exists()]
+
+
+def upload_worker():
     while True:
+        batch = next_batch()
+        if not batch:
+            continue
+        names = ", ".join(file.name for file in batch)
         try:
-            for file in WATCH_FOLDER.glob("tx_clean_*.pcap"):
-                if file.name not in uploaded_files:
-                    try:
-                        with open(file, "rb") as f:
-                            files = {'pcap_file': f}
-                            data = {'laptop_id': LAPTOP_ID}
-                            response = requests.post(CENTRAL_SERVER_URL, files=files, data=data)
-                            if response.status_code == 200:
-                                print(f"Uploaded {file.name}")
-                                uploaded_files.add(file.name)
-                            else:
-                                print(f"Failed to upload {file.name}: {response.text}")
-                    except Exception as e:
-                        print(f"Error uploading {file.name}: {e}")
-
-            time.sleep(5)
-        
-        except KeyboardInterrupt:
-            raise  # Re-raise to be caught by outer except block
+            with ExitStack() as stack:
+                # One POST carries the whole batch; MultipartEncoder streams the pcaps off disk
+                fields = [('laptop_id', LAPTOP_ID)]
+                for file in batch:
+                    f = stack.enter_context(open(file, "rb"))
+                    fields.append(('pcap_file', (file.name, f, 'application/octet-stream')))
+                body = MultipartEncoder(fields=fields)
+                response = SESSION.post(CENTRAL_SERVER_URL, data=body,
+                                        headers={'Content-Type': body.content_type}, timeout=UPLOAD_TIMEOUT)
+            if response.status_code == 200:
+                # Uploaded snapshots leave the watched folder, so nothing needs remembering
+                for file in batch:
+                    file.replace(UPLOADED_FOLDER / file.name)
+                print(f"Uploaded {names}")
+                continue
+            print(f"Failed to upload {names}: {response.text}")
+        except Exception as e:
+            print(f"Error uploading {names}: {e}")
+        time.sleep(RETRY_DELAY)
+        for file in batch:
+            pending.put(file)
+
+
+def start_observer():
+    observer = Observer()
+    observer.schedule(SnapshotHandler(), str(WATCH_FOLDER), recursive=False)
+    try:
+        observer.start()
+        return observer
+    except OSError as e:
+        # e.g. inotify watch limit reached or a filesystem without change notifications
+        print(f"[WARN] Native folder watching unavailable ({e}), polling every {POLL_FALLBACK_INTERVAL}s instead")
+
+    # Cheap even when polling: uploaded snapshots are moved out, so only pending files are listed
+    observer = PollingObserver(timeout=POLL_FALLBACK_INTERVAL)
+    observer.schedule(SnapshotHandler(), str(WATCH_FOLDER), recursive=False)
+    observer.start()
+    return observer
+
+
+UPLOADED_FOLDER.mkdir(parents=True, exist_ok=True)
+
+# Snapshots written while the uploader was not running
+for file in WATCH_FOLDER.glob(SNAPSHOT_PATTERN):
+    pending.put(file)
+
+observer = start_observer()
+threading.Thread(target=upload_worker, daemon=True).start()
+
+print(f"Monitoring {WATCH_FOLDER} folder for completed TX snapshots to upload to the central server…")
+
+try:
+    while observer.is_alive():
+        observer.join(1)
 
 except KeyboardInterrupt:
     print("\n[INFO] Server side uploading script stopped manually (Ctrl+c) by the admin...")
+
+finally:
+    observer.stop()
+    observer.join()
@@ -1,32 +1,76 @@
 import socket
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
 
 # Target OBU Details
 UDP_IP = "192.168.52.79"
 UDP_PORT = 12345
 
+STALL_FLAG = Path("rx_stalled.flag")
+SEND_INTERVAL = 10
+
+# Set/cleared from filesystem events instead of checking the flag every 10s
+rx_stalled = threading.Event()
+rx_growing = threading.Event()
+
+
+class StallFlagHandler(FileSystemEventHandler):
+    def on_any_event(self, event):
+        if STALL_FLAG.name in (Path(event.src_path).name, Path(getattr(event, "dest_path", "")).name):
+            update_stall_state()
+
+
+def update_stall_state():
+    if STALL_FLAG.exists():
+        rx_growing.clear()
+        rx_stalled.set()
+    else:
+        rx_stalled.clear()
+        rx_growing.set()
+
+
+def wait_for(event, timeout=None):
+    # Short waits keep Ctrl+C responsive on Windows, where a blocking Event.wait() can't be interrupted
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not event.wait(1):
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+    return True
+
+
 # Create a UDP socket
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+observer = Observer()
+observer.schedule(StallFlagHandler(), str(STALL_FLAG.resolve().parent), recursive=False)
+observer.start()
+update_stall_state()
+
 print("[INFO] Monitoring RX stall status and sending packets every 10s during stalls...")
 
 try:
     while True:
-        if Path("rx_stalled.flag").exists():
-            # Compose dynamic message with timestamp
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            message = f"Hello from Laptop! You are currently out of RSU zone. Timestamp: {timestamp}"
-            sock.sendto(message.encode(), (UDP_IP, UDP_PORT))
-            print(f"[{timestamp}] RX stalled → Message sent to OBU.")
-        else:
+        if not rx_stalled.is_set():
             print(f"[{datetime.now().strftime('%H:%M:%S')}] RX growing → No packet sent.")
-        
-        time.sleep(10)  # 10s interval
+            wait_for(rx_stalled)
+
+        # Compose dynamic message with timestamp
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        message = f"Hello from Laptop! You are currently out of RSU zone. Timestamp: {timestamp}"
+        sock.sendto(message.encode(), (UDP_IP, UDP_PORT))
+        print(f"[{timestamp}] RX stalled → Message sent to OBU.")
+
+        # Next message after 10s, or straight back to idle as soon as the flag is removed
+        wait_for(rx_growing, SEND_INTERVAL)
 
 except KeyboardInterrupt:
     print("\n[INFO] Script stopped by user.")
 
 finally:
+    observer.stop()
+    observer.join()
     sock.close()